@@ -0,0 +1,130 @@
+"""
+batch_writer.py
+
+This file groups concurrent meal plan writes into Firestore batch commits.
+Writes are queued by the generate endpoint and committed by a background task, so a burst of
+requests costs a few batch RPCs instead of one RPC per meal plan.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Set, Tuple
+from google.api_core.exceptions import Conflict, RetryError
+from google.api_core.retry import Retry, if_transient_error
+from google.cloud.firestore_v1 import Client
+
+logger = logging.getLogger(__name__)
+
+# Firestore write batching configuration
+batch_max_size = 400  # Firestore rejects batches of more than 500 writes.
+batch_max_wait = 0.02  # Seconds to wait for concurrent writes to join a batch.
+batch_chunk_size = 50  # Writes per commit; chunks of a drained batch are committed in parallel.
+batch_commit_threads = 10
+
+# Function to commit a chunk of meal plans to Firestore in a single RPC, retrying with
+# exponential backoff on transient errors and contention (Aborted is a Conflict)
+@Retry(predicate=lambda e: if_transient_error(e) or isinstance(e, Conflict), initial=0.5, maximum=30)
+def commit_meal_plan_batch(writes: List[Tuple[str, dict, asyncio.Future]], firestore_client: Client, collection_name: str):
+    batch = firestore_client.batch()
+    for meal_plan_id, meal_plan_data, _ in writes:
+        batch.set(firestore_client.collection(collection_name).document(meal_plan_id), meal_plan_data)
+    batch.commit()
+
+class MealPlanBatchWriter:
+    """
+    Background writer that commits queued meal plans to Firestore in batches.
+
+    The queue and semaphore are created in start(), since on Python 3.9 they bind to the
+    event loop that is running when they are created.
+    """
+    def __init__(self, firestore_client: Client, collection_name: str):
+        self.firestore_client = firestore_client
+        self.collection_name = collection_name
+        # Dedicated threads for blocking batch commits, so they do not compete with the anyio threadpool
+        self.commit_pool = ThreadPoolExecutor(max_workers=batch_commit_threads)
+        self.queue: Optional[asyncio.Queue] = None
+        self.commit_slots: Optional[asyncio.Semaphore] = None
+        self.drain_task: Optional[asyncio.Task] = None
+        self.commit_tasks: Set[asyncio.Task] = set()
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.commit_slots = asyncio.Semaphore(batch_commit_threads)
+        self.drain_task = asyncio.create_task(self.drain())
+
+    async def stop(self):
+        # Writes already taken off the queue are committed before the threads are released
+        self.drain_task.cancel()
+        await asyncio.gather(*self.commit_tasks, return_exceptions=True)
+        self.commit_pool.shutdown(wait=False)
+
+    # Queue a meal plan and wait until the batch holding it is committed
+    async def write(self, meal_plan_id: str, meal_plan_data: dict):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((meal_plan_id, meal_plan_data, future))
+        await future
+
+    # Take batches off the queue and commit each in its own task, so one slow batch (e.g. one
+    # retrying transient errors) does not hold back the writes queued behind it
+    async def drain(self):
+        while True:
+            writes = [await self.queue.get()]
+            await asyncio.sleep(batch_max_wait)
+            while len(writes) < batch_max_size and not self.queue.empty():
+                writes.append(self.queue.get_nowait())
+
+            await self.commit_slots.acquire()
+            task = asyncio.create_task(self.commit_writes(writes))
+            self.commit_tasks.add(task)
+            task.add_done_callback(self.commit_tasks.discard)
+
+    # Commit a drained batch in parallel chunks and resolve the future of every write in it
+    async def commit_writes(self, writes: List[Tuple[str, dict, asyncio.Future]]):
+        try:
+            chunks = [writes[i:i + batch_chunk_size] for i in range(0, len(writes), batch_chunk_size)]
+            results = await asyncio.gather(
+                *(self.commit_chunk(chunk) for chunk in chunks),
+                return_exceptions=True
+            )
+
+            # gather() can also return BaseExceptions such as CancelledError, which must not count as saved
+            for chunk, result in zip(chunks, results):
+                errors = [result] * len(chunk) if isinstance(result, BaseException) else result
+                for (meal_plan_id, _, future), error in zip(chunk, errors):
+                    if isinstance(error, BaseException):
+                        logger.error("Error committing meal plan %s: %r", meal_plan_id, error)
+                    if future.done():
+                        continue
+                    if isinstance(error, asyncio.CancelledError):
+                        future.cancel()
+                    elif isinstance(error, BaseException):
+                        future.set_exception(error)
+                    else:
+                        future.set_result(None)
+        finally:
+            self.commit_slots.release()
+            for _ in writes:
+                self.queue.task_done()
+
+    # Commit a chunk of meal plans, returning the error (or None) for each write. A batch
+    # commits or fails as a whole, so if the chunk is rejected for a non-transient reason (e.g. one
+    # oversized document), its writes are retried one per commit so only the bad write fails.
+    async def commit_chunk(self, writes: List[Tuple[str, dict, asyncio.Future]]):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.commit_pool, commit_meal_plan_batch, writes,
+                                       self.firestore_client, self.collection_name)
+            return [None] * len(writes)
+        except RetryError as e:
+            # Transient errors persisted past the retry deadline; committing separately will not help
+            return [e] * len(writes)
+        except Exception as e:
+            if len(writes) == 1:
+                return [e]
+
+        return await asyncio.gather(
+            *(loop.run_in_executor(self.commit_pool, commit_meal_plan_batch, [write],
+                                   self.firestore_client, self.collection_name)
+              for write in writes),
+            return_exceptions=True
+        )
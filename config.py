@@ -1,3 +1,29 @@
 # config.py
 
-API_KEY = "<ANONYMIZED_API_KEY>"
\ No newline at end of file
+import os
+
+API_KEY = "<ANONYMIZED_API_KEY>"
+
+# Redis instance backing the semantic meal plan cache.
+REDIS_URL = "redis://localhost:6379"
+
+# How long (in seconds) a generated meal plan is served from the semantic cache.
+SEMANTIC_CACHE_TTL = 60 * 60 * 24
+
+# How long (in seconds) identical meal tag requests are served from the in-process cache.
+MEAL_PLAN_CACHE_TTL = 60 * 60
+
+# Maximum number of meal plans held in the in-process cache.
+MEAL_PLAN_CACHE_SIZE = 1000
+
+# How long (in seconds) meal plans read from Firestore are cached in-process and by clients.
+READ_CACHE_TTL = 60 * 5
+
+# Maximum number of meal plans held in the read cache.
+READ_CACHE_SIZE = 10000
+
+# Number of threads available to blocking calls dispatched from async endpoints.
+THREADPOOL_SIZE = 200
+
+# Log full ChatGPT responses at debug level. Off by default: the dump copies every response body.
+DEBUG_LLM = os.getenv("DEBUG_LLM", "").lower() in ("1", "true", "yes")
\ No newline at end of file
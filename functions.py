@@ -1,9 +1,88 @@
-from typing import List
+from typing import Dict, List
+import asyncio
+import hashlib
+import logging
 import random
 import string
-import requests
-from requests_toolbelt.utils import dump
-from config import API_KEY
+import anyio.to_thread
+import httpx
+import orjson
+from cachetools import TLRUCache
+from redisvl.extensions.llmcache import SemanticCache
+from redisvl.utils.vectorize import HFTextVectorizer
+from config import API_KEY, DEBUG_LLM, REDIS_URL, SEMANTIC_CACHE_TTL, MEAL_PLAN_CACHE_TTL, MEAL_PLAN_CACHE_SIZE
+
+# Shared HTTP client so concurrent requests reuse pooled connections to the ChatGPT API.
+# Idle connections are kept alive for a minute (httpx defaults to 5 seconds) so that
+# requests arriving a few seconds apart still skip the TCP/TLS handshake.
+client = httpx.AsyncClient(
+    base_url="https://api.openai.com/v1",
+    http2=True,
+    timeout=30,
+    limits=httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=60)
+)
+
+# Characters used in meal plan identifiers.
+ALPHABET = string.ascii_uppercase + string.digits
+
+# The meal plan prompt never changes at runtime, so read it once at import.
+with open("prompt.txt", "r", encoding="utf-8") as file:
+    PROMPT = file.read()
+
+# Static parts of every ChatGPT request, built once rather than per call.
+CHATGPT_ENDPOINT = "/chat/completions"
+
+HEADERS = {
+    "Authorization": f"Bearer {API_KEY}",
+    "Content-Type": "application/json"
+}
+
+PREFIX = "The following are meal tags that will be used as part of generating the query:  "
+
+# The system message (index 0) is filled in per call with the requested meal tags.
+PAYLOAD_TEMPLATE = {
+    "model": "gpt-3.5-turbo",
+    "messages": [
+        None,
+        {"role": "user", "content": PROMPT}
+    ]
+}
+
+logger = logging.getLogger(__name__)
+
+# Nothing else configures logging for the app, so DEBUG_LLM brings its own handler for the
+# ChatGPT responses it logs instead of relying on the root logger being set to DEBUG.
+if DEBUG_LLM:
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler())
+    logger.propagate = False
+
+# Semantic cache so that requests with equivalent meal tags skip the ChatGPT round-trip.
+try:
+    vectorizer = HFTextVectorizer("redis/langcache-embed-v2")
+    llmcache = SemanticCache(
+        name="mealplan",
+        redis_url=REDIS_URL,
+        distance_threshold=0.1,
+        ttl=SEMANTIC_CACHE_TTL,
+        vectorizer=vectorizer
+    )
+    logger.info("Semantic cache initialized successfully!")
+except Exception as e:
+    llmcache = None
+    logger.error("Error initializing semantic cache: %r", e)
+
+# Exact-match cache of generated meal plans, keyed by a hash of the sorted meal tags.
+# Lookups and fills never await while touching these dicts, so the event loop already
+# serialises them and no lock is needed.
+# Each entry expires after MEAL_PLAN_CACHE_TTL jittered by +/-10%, so entries created together
+# do not all expire (and hit ChatGPT) at the same moment.
+cache = TLRUCache(
+    maxsize=MEAL_PLAN_CACHE_SIZE,
+    ttu=lambda _key, _meal_plan, now: now + MEAL_PLAN_CACHE_TTL * random.uniform(0.9, 1.1)
+)
+# Generations currently in progress, so concurrent identical requests share one ChatGPT call.
+pending_generations: Dict[str, asyncio.Task] = {}
 
 def generate_identifier() -> str:
     """
@@ -12,54 +91,120 @@ def generate_identifier() -> str:
     Returns:
         str: The generated identifier.
     """
-    characters = string.ascii_uppercase  + string.digits
-    return ''.join(random.choice(characters) for _ in range(7))
+    return ''.join(random.choices(ALPHABET, k=7))
 
 
-def generate_meal_plan(meal_tags: List[str]) -> dict:
+def meal_tags_cache_key(meal_tags: List[str]) -> str:
     """
-    Generate a meal plan using the ChatGPT API.
+    Build the exact-match cache key for a list of meal tags.
 
     Args:
         meal_tags (List[str]): List of meal tags to be used as part of generating the query.
 
     Returns:
-        dict: A dictionary containing the generated meal plan.
-    
+        str: SHA-256 hex digest of the sorted meal tags.
     """
-    chatgpt_endpoint = "https://api.openai.com/v1/chat/completions"
-    
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
+    return hashlib.sha256(orjson.dumps(sorted(meal_tags))).hexdigest()
+
 
-    with open("prompt.txt", "r", encoding="utf-8") as file:
-        prompt = file.read()
+def fill_cache(cache_key: str, generation: asyncio.Task) -> None:
+    """
+    Store a finished generation in the exact-match cache.
 
-    prefix = "The following are meal tags that will be used as part of generating the query:  "
-    tags_string = ','.join(meal_tags)
-    tags_string_with_prefix = prefix + tags_string # Convert list to a comma separated string.
+    Args:
+        cache_key (str): The exact-match cache key of the generation.
+        generation (asyncio.Task): The finished generation task.
+    """
+    pending_generations.pop(cache_key, None)
+    if generation.cancelled() or generation.exception() is not None:
+        return
+    cache[cache_key] = generation.result()
+
+
+async def generate_meal_plan(meal_tags: List[str]) -> dict:
+    """
+    Generate a meal plan, serving identical meal tag sets from the exact-match cache.
+
+    Args:
+        meal_tags (List[str]): List of meal tags to be used as part of generating the query.
+
+    Returns:
+        dict: A dictionary containing the generated meal plan as raw JSON bytes.
+    """
+    cache_key = meal_tags_cache_key(meal_tags)
+    meal_plan = cache.get(cache_key)
+    if meal_plan is not None:
+        return meal_plan
+
+    generation = pending_generations.get(cache_key)
+    if generation is None:
+        generation = asyncio.ensure_future(fetch_meal_plan(meal_tags))
+        generation.add_done_callback(lambda task: fill_cache(cache_key, task))
+        pending_generations[cache_key] = generation
+
+    # Shield the shared generation so one client disconnecting does not cancel it for the others.
+    return await asyncio.shield(generation)
+
+
+async def fetch_meal_plan(meal_tags: List[str]) -> dict:
+    """
+    Generate a meal plan using the ChatGPT API.
+
+    Args:
+        meal_tags (List[str]): List of meal tags to be used as part of generating the query.
+
+    Returns:
+        dict: A dictionary containing the generated meal plan as raw JSON bytes.
+    
+    """
+    # Sort the tags so that the same set in a different order maps to the same cache entry.
+    cache_key = ','.join(sorted(meal_tags))
+    cache_vector = None
+    if llmcache is not None:
+        # Embedding the key is blocking, CPU-bound work, so keep it off the event loop, and
+        # embed it once for both the lookup and the store. A cache failure falls through to ChatGPT.
+        try:
+            cache_vector = await anyio.to_thread.run_sync(vectorizer.embed, cache_key)
+            cached = await anyio.to_thread.run_sync(lambda: llmcache.check(vector=cache_vector))
+            if cached:
+                return {"generated_meal_plan": cached[0]["response"].encode()}
+        except Exception as e:
+            logger.error("Error checking semantic cache: %r", e)
 
     payload = {
-        "model": "gpt-3.5-turbo",
+        **PAYLOAD_TEMPLATE,
         "messages": [
-            {"role": "system", "content": tags_string_with_prefix},  # Using the passed meal tags
-            {"role": "user", "content": prompt}
+            {"role": "system", "content": PREFIX + ','.join(meal_tags)},  # Using the passed meal tags
+            PAYLOAD_TEMPLATE["messages"][1]
         ]
     }
 
-    response = requests.post(
-        chatgpt_endpoint,
-        headers=headers,
-        json=payload,
-        timeout=30  # Add a timeout value in seconds
-    )
+    # Read the body chunk by chunk as it arrives; the JSON is parsed once the stream completes.
+    response_body = bytearray()
+    async with client.stream(
+        "POST",
+        CHATGPT_ENDPOINT,
+        headers=HEADERS,
+        content=orjson.dumps(payload)
+    ) as response:
+        async for chunk in response.aiter_bytes():
+            response_body.extend(chunk)
 
-    data = dump.dump_all(response)
-    print(data.decode('utf-8'))
+    if DEBUG_LLM:
+        logger.debug("ChatGPT response: %s", response_body.decode("utf-8", errors="replace"))
 
-    data = response.json()
+    data = orjson.loads(response_body)
     generated_meal_plan = data.get("choices", [])[0].get("message", {}).get("content", "")
 
-    return {"generated_meal_plan": generated_meal_plan}
\ No newline at end of file
+    # Raise on a reply that is not JSON (e.g. fenced or empty) so it is never cached.
+    orjson.loads(generated_meal_plan)
+
+    if cache_vector is not None:
+        try:
+            await anyio.to_thread.run_sync(
+                lambda: llmcache.store(prompt=cache_key, response=generated_meal_plan, vector=cache_vector)
+            )
+        except Exception as e:
+            logger.error("Error storing meal plan in semantic cache: %r", e)
+
+    return {"generated_meal_plan": generated_meal_plan.encode()}
\ No newline at end of file
@@ -0,0 +1,18 @@
+# gunicorn.conf.py
+
+import os
+
+bind = "0.0.0.0:80"
+
+# Uvicorn workers pick up uvloop and httptools automatically when they are installed.
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# More than one process so JSON parsing and other CPU-bound work is not serialised on a
+# single event loop. Every worker loads its own copy of the semantic cache's embedding
+# model, so the default stays small rather than scaling with the node's core count;
+# raise it with WEB_CONCURRENCY in line with the container's CPU and memory limits.
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+
+# Workers load the embedding model while booting, which takes longer than gunicorn's
+# default 30 second timeout on a cold start.
+timeout = 120
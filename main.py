@@ -6,109 +6,217 @@ Includes endpoints for generating, reading, updating, and deleting meal plans.
  The application interacts with ChatGPT to generate meal plans based on specified meal tags.
 
 Usage:
-1. Start the FastAPI server using the command: `python -m uvicorn main:app --reload`.
+1. Start the FastAPI server using the command: `python -m uvicorn main:app --reload` for development,
+   or `gunicorn main:app` in production (worker settings are read from 'gunicorn.conf.py').
 2. Access the API documentation at `http://localhost:8000/docs` to explore and test the available endpoints.
 
 Note:
 - Ensure that the ChatGPT API key is configured in the 'config.py' file for generating meal plans.
-- The application uses an in-memory database (`fake_db`) to store meal plans during runtime.
+- Meal plans are stored in the Firestore collection configured below.
 """
-import json
-from fastapi import FastAPI, HTTPException, Depends
-from fastapi.responses import JSONResponse
+import asyncio
+import hashlib
+import logging
+import anyio.to_thread
+from typing import Optional, Set
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse
 from models import MealPlanRequest, MealPlan
-from functions import generate_identifier, generate_meal_plan
+from functions import generate_identifier, generate_meal_plan, client
+from batch_writer import MealPlanBatchWriter
+from config import MEAL_PLAN_CACHE_TTL, READ_CACHE_TTL, READ_CACHE_SIZE, THREADPOOL_SIZE
 from google.cloud import firestore
+from google.cloud.firestore import AsyncClient
 from google.cloud.firestore_v1 import Client
+from google.api_core.exceptions import NotFound
+import msgspec
+import orjson
 import os
 
 key_file_path = r"hazel-charter-408317-17272dc7fc29.json"
 os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = key_file_path
 
-# Create a FastAPI instance
-app = FastAPI()
+logger = logging.getLogger(__name__)
 
-# In-memory database to store meal plans
-fake_db = []
+# Create a FastAPI instance
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Firestore configuration
 project_id = "hazel-charter-408317"
 database_id = "meal-plan-db" 
 collection_name = "meal-plans"
 
-# Initialize Firestore client
-try:
-    firestore_client = firestore.Client()
-    print("Firestore client initialized successfully!")
-except Exception as e:
-    print(f"Error initializing Firestore client: {e}")
+# Decoder for generate request bodies, and the schema FastAPI cannot derive from a msgspec struct
+meal_plan_request_decoder = msgspec.json.Decoder(MealPlanRequest)
+meal_plan_request_schema = msgspec.json.schema_components([MealPlanRequest])[1]["MealPlanRequest"]
+
+# Read-through cache of serialized meal plans and their ETags, keyed by meal plan identifier.
+# It is only touched between awaits on the event loop, so it needs no lock. Each server worker
+# keeps its own copy, so a change made through one worker can be served stale by another for
+# up to READ_CACHE_TTL seconds.
+meal_plan_cache = TTLCache(maxsize=READ_CACHE_SIZE, ttl=READ_CACHE_TTL)
+
+# Invalidation count per meal plan identifier, bumped by every update and delete. A read only
+# fills the cache if the count is unchanged since it started, so a read that was already waiting
+# on Firestore does not cache the snapshot an update or delete just replaced. Counts expire with
+# the cache, long after any read that could have observed them has finished.
+meal_plan_versions = TTLCache(maxsize=READ_CACHE_SIZE, ttl=READ_CACHE_TTL)
+
+# Function to drop a meal plan from the read cache after it was changed in Firestore
+def invalidate_meal_plan(meal_plan_id: str):
+    meal_plan_cache.pop(meal_plan_id, None)
+    meal_plan_versions[meal_plan_id] = meal_plan_versions.get(meal_plan_id, 0) + 1
+
+# Firestore clients, shared across requests. They are created on startup so that each
+# server worker process opens its own gRPC channels, bound to that worker's event loop.
+firestore_client: Optional[Client] = None
+async_firestore_client: Optional[AsyncClient] = None
+
+@app.on_event("startup")
+async def init_firestore_clients():
+    global firestore_client, async_firestore_client
+    try:
+        firestore_client = firestore.Client(project=project_id, database=database_id)
+        async_firestore_client = AsyncClient(project=project_id, database=database_id)
+        print("Firestore client initialized successfully!")
+    except Exception as e:
+        print(f"Error initializing Firestore client: {e}")
+
+# Size the anyio threadpool that blocking calls (such as semantic cache lookups) are
+# dispatched to, so bursts are not capped at anyio's default of 40 threads
+@app.on_event("startup")
+async def set_threadpool_size():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await client.aclose()
 
 def get_firestore_client():
-    return firestore.Client(project=project_id, database=database_id)
-
-# Function to create a meal plan in Firestore
-def create_meal_plan_firestore(meal_plan_id: str, meal_plan_data: dict, firestore_client: Client):
-    meal_plan_ref = firestore_client.collection(collection_name).document(meal_plan_id)
-    meal_plan_ref.set(meal_plan_data)
+    return firestore_client
+
+async def get_async_firestore_client():
+    return async_firestore_client
+
+# Background writer that batches meal plan writes, started with the app
+batch_writer: Optional[MealPlanBatchWriter] = None
+
+# Meal plan writes still in flight after their generate response was sent
+background_writes: Set[asyncio.Task] = set()
+
+@app.on_event("startup")
+async def start_batch_writer():
+    global batch_writer
+    batch_writer = MealPlanBatchWriter(get_firestore_client(), collection_name)
+    batch_writer.start()
+
+@app.on_event("shutdown")
+async def stop_batch_writer():
+    # Let meal plans that were already returned to clients reach Firestore before exiting
+    await asyncio.gather(*background_writes, return_exceptions=True)
+    await batch_writer.stop()
+
+# Function to create a meal plan in Firestore, batched with other concurrent writes
+async def create_meal_plan_firestore(meal_plan_id: str, meal_plan_data: dict):
+    await batch_writer.write(meal_plan_id, meal_plan_data)
+
+# Callback for a background meal plan write. If it failed after all retries, the meal plan is
+# evicted from the read cache so this worker stops serving a plan that was never saved.
+def finish_background_write(meal_plan_id: str, write: asyncio.Task):
+    background_writes.discard(write)
+    if write.cancelled():
+        meal_plan_cache.pop(meal_plan_id, None)
+        logger.error("Saving meal plan %s was cancelled", meal_plan_id)
+    elif write.exception() is not None:
+        meal_plan_cache.pop(meal_plan_id, None)
+        logger.error("Error saving meal plan %s: %r", meal_plan_id, write.exception())
+
+# Function to check an If-None-Match header against an ETag, using the weak comparison
+# (a W/-weakened copy of a tag still matches, e.g. after a proxy compressed the response)
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag.removeprefix("W/"):
+            return True
+    return False
 
 # Function to read a meal plan from Firestore
-def read_meal_plan_firestore(meal_plan_id: str, firestore_client: Client):
+async def read_meal_plan_firestore(meal_plan_id: str, firestore_client: AsyncClient):
     meal_plan_ref = firestore_client.collection(collection_name).document(meal_plan_id)
-    meal_plan_data = meal_plan_ref.get().to_dict()
-    return meal_plan_data
+    meal_plan_snapshot = await meal_plan_ref.get()
+    return meal_plan_snapshot.to_dict()
 
 # Function to update a meal plan in Firestore
-def update_meal_plan_firestore(meal_plan_id: str, meal_plan_data: dict, firestore_client: Client):
+async def update_meal_plan_firestore(meal_plan_id: str, meal_plan_data: dict, firestore_client: AsyncClient):
     meal_plan_ref = firestore_client.collection(collection_name).document(meal_plan_id)
-    meal_plan_ref.update(meal_plan_data)
+    await meal_plan_ref.update(meal_plan_data)
 
-# Function to delete a meal plan from Firestore
-def delete_meal_plan_firestore(meal_plan_id: str, firestore_client: Client):
+# Function to delete a meal plan from Firestore, raising NotFound if it does not exist
+async def delete_meal_plan_firestore(meal_plan_id: str, firestore_client: AsyncClient):
     meal_plan_ref = firestore_client.collection(collection_name).document(meal_plan_id)
-    meal_plan_data = meal_plan_ref.get().to_dict()
-    meal_plan_ref.delete()
-    return meal_plan_data
+    await meal_plan_ref.delete(option=firestore_client.write_option(exists=True))
 
 
 
-@app.post("/meal-plans/generate")
-def create_meal_plan(meal_plan_request: MealPlanRequest, firestore_client: Client = Depends(get_firestore_client)):
+@app.post("/meal-plans/generate", openapi_extra={
+    "requestBody": {"required": True, "content": {"application/json": {"schema": meal_plan_request_schema}}}
+})
+async def create_meal_plan(request: Request):
     """
     Create a new meal plan using ChatGPT based on provided meal tags.
 
     Parameters:
-    - meal_plan_request (MealPlanRequest): The request containing meal tags.
+    - request body (MealPlanRequest): The request containing meal tags.
 
     Returns:
-    - JSONResponse: A JSON response containing the generated meal plan and its unique identifier.
+    - Response: A JSON response containing the generated meal plan and its unique identifier.
+    - If the request body is not valid JSON for a MealPlanRequest, responds with FastAPI's usual 422 validation error.
     """
+    # Like FastAPI's own body handling, only decode as JSON if the client did not declare another type
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    if content_type != "application/json" and not (content_type.startswith("application/") and content_type.endswith("+json")):
+        raise RequestValidationError([{"loc": ("body",), "msg": "Request body must be JSON", "type": "value_error"}])
+
+    try:
+        meal_plan_request = meal_plan_request_decoder.decode(await request.body())
+    except msgspec.DecodeError as e:
+        raise RequestValidationError([{"loc": ("body",), "msg": str(e), "type": "value_error"}])
+
     meal_plan_tags = meal_plan_request.meal_tags
     meal_plan_id = generate_identifier()
-    generated_meal_plan_result = generate_meal_plan(meal_plan_tags)
+    generated_meal_plan_result = await generate_meal_plan(meal_plan_tags)
+    generated_meal_plan = generated_meal_plan_result['generated_meal_plan']
+
+    # Firestore needs the parsed meal plan; the response splices the raw JSON in instead of re-serializing it.
     formatted_response = {
         "id": meal_plan_id,
-        "result": json.loads(generated_meal_plan_result['generated_meal_plan'])
+        "result": orjson.loads(generated_meal_plan)
     }
 
-    # Save the meal plan to Firestore
-    create_meal_plan_firestore(meal_plan_id, formatted_response, firestore_client)
+    # Save the meal plan to Firestore in the background so the response does not wait on the write
+    write = asyncio.create_task(create_meal_plan_firestore(meal_plan_id, formatted_response))
+    background_writes.add(write)
+    write.add_done_callback(lambda task: finish_background_write(meal_plan_id, task))
 
-    return JSONResponse(content=formatted_response)
+    content = b'{"id":"' + meal_plan_id.encode() + b'","result":' + generated_meal_plan + b'}'
+    etag = f'"{hashlib.sha256(content).hexdigest()}"'
 
+    # Prime the read cache so that reading the plan straight back does not race the pending write
+    meal_plan_cache[meal_plan_id] = (content, etag)
 
-@app.get("/debug/get-database")
-def retrieve_current_database_view():
-    """
-    Debug endpoint to retrieve the contents of the in-memory meal plans database (fake_db).
+    # The body carries a freshly minted meal plan id, so only the requesting client may reuse it.
+    headers = {"Cache-Control": f"private, max-age={MEAL_PLAN_CACHE_TTL}", "ETag": etag}
 
-    Returns:
-        List[MealPlan]: A list containing the meal plans stored in the in-memory database.
-    """
-    return fake_db
+    return Response(content=content, media_type="application/json", headers=headers)
 
 # Endpoint to read a meal plan by its identifier
 @app.get("/meal-plans/{meal_plan_id}")
-def read_meal_plan(meal_plan_id: str, firestore_client: Client = Depends(get_firestore_client)):
+async def read_meal_plan(meal_plan_id: str, if_none_match: Optional[str] = Header(None),
+                         firestore_client: AsyncClient = Depends(get_async_firestore_client)):
     """
     Retrieve a meal plan by its unique identifier.
 
@@ -117,16 +225,29 @@ def read_meal_plan(meal_plan_id: str, firestore_client: Client = Depends(get_fir
 
     Returns:
     - If found, returns the details of the meal plan.
+    - If the client's `If-None-Match` header matches the current ETag, returns 304 Not Modified.
     - If not found, raises an HTTPException with a 404 status code and a detailed error message.
     """
-    meal_plan_data = read_meal_plan_firestore(meal_plan_id, firestore_client)
-    if meal_plan_data:
-        return meal_plan_data
-    raise HTTPException(status_code=404, detail="Meal plan not found")
+    cached = meal_plan_cache.get(meal_plan_id)
+    if cached is None:
+        version = meal_plan_versions.get(meal_plan_id, 0)
+        meal_plan_data = await read_meal_plan_firestore(meal_plan_id, firestore_client)
+        if not meal_plan_data:
+            raise HTTPException(status_code=404, detail="Meal plan not found")
+        body = orjson.dumps(meal_plan_data)
+        cached = (body, f'"{hashlib.sha256(body).hexdigest()}"')
+        if meal_plan_versions.get(meal_plan_id, 0) == version:
+            meal_plan_cache[meal_plan_id] = cached
+
+    body, etag = cached
+    headers = {"Cache-Control": f"max-age={READ_CACHE_TTL}", "ETag": etag}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 # Endpoint to update an existing meal plan
 @app.put("/meal-plans/{meal_plan_id}")
-def update_meal_plan(meal_plan_id: str, meal_plan: MealPlan, firestore_client: Client = Depends(get_firestore_client)):
+async def update_meal_plan(meal_plan_id: str, meal_plan: MealPlan, firestore_client: AsyncClient = Depends(get_async_firestore_client)):
     """
     Update an existing meal plan by providing a new set of details.
 
@@ -140,13 +261,14 @@ def update_meal_plan(meal_plan_id: str, meal_plan: MealPlan, firestore_client: C
     """
 
     meal_plan_data = meal_plan.model_dump(exclude_unset=True)
-    update_meal_plan_firestore(meal_plan_id, meal_plan_data, firestore_client)
+    await update_meal_plan_firestore(meal_plan_id, meal_plan_data, firestore_client)
+    invalidate_meal_plan(meal_plan_id)
     return {"meal_plan_id": meal_plan_id, "meal_plan_name": meal_plan.name,
             "message": "Meal plan updated successfully"}
 
 # Endpoint to delete an existing meal plan
 @app.delete("/meal-plans/{meal_plan_id}")
-def delete_meal_plan(meal_plan_id: str, firestore_client: Client = Depends(get_firestore_client)):
+async def delete_meal_plan(meal_plan_id: str, firestore_client: AsyncClient = Depends(get_async_firestore_client)):
     """
     Delete an existing meal plan by its unique identifier.
 
@@ -157,8 +279,10 @@ def delete_meal_plan(meal_plan_id: str, firestore_client: Client = Depends(get_f
     - If the meal plan is found and deleted successfully, returns a success message.
     - If the meal plan is not found, raises an HTTPException with a 404 status code.
     """
-    meal_plan_data = delete_meal_plan_firestore(meal_plan_id, firestore_client)
-    if meal_plan_data:
-        return {"meal_plan_id": meal_plan_id, "meal_plan_name": meal_plan_data.get("name"),
-                "message": "Meal plan deleted successfully"}
-    raise HTTPException(status_code=404, detail="Meal plan not found")
+    try:
+        await delete_meal_plan_firestore(meal_plan_id, firestore_client)
+    except NotFound:
+        raise HTTPException(status_code=404, detail="Meal plan not found")
+    finally:
+        invalidate_meal_plan(meal_plan_id)
+    return {"meal_plan_id": meal_plan_id, "message": "Meal plan deleted successfully"}
@@ -1,11 +1,13 @@
 """
 models.py
 
-This module contains Pydantic models for handling meal plans.
+This module contains Pydantic models for handling meal plans, and a msgspec struct
+for the meal plan generation request, which is decoded on every generate call.
 
 """
 from typing import List, Optional
-from pydantic import BaseModel, Field
+import msgspec
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class NutritionalInformation(BaseModel):
@@ -47,22 +49,9 @@ class Meal(BaseModel):
     """
     recipe: Recipe
 
-class CreateMealPlan(BaseModel):
+class MealPlanRequest(msgspec.Struct, frozen=True, forbid_unknown_fields=True):
     """
-    Pydantic model for creating a meal plan.
-
-    Attributes:
-        name (str): The name of the meal plan.
-        description (str): The description of the meal plan.
-        meals (List[Meal]): The list of meals in the meal plan.
-    """
-    name: str
-    description: str
-    meals: List[Meal]
-
-class MealPlanRequest(BaseModel):
-    """
-    Pydantic model for a meal plan request.
+    msgspec struct for a meal plan request.
 
     Attributes:
         meal_tags (List[str]): List of meal tags to be used in generating the query.
@@ -79,7 +68,9 @@ class MealPlan(BaseModel):
         description (str): The description of the meal plan.
         meals (List[Meal]): The list of meals in the meal plan.
     """
-    id: str = Field(min_length=7, max_length=7, pattern="^[a-zA-Z0-9]+$")
+    model_config = ConfigDict(str_strip_whitespace=False, extra='forbid', frozen=True)
+
+    id: str = Field(min_length=7, max_length=7, pattern=r"^[A-Za-z0-9]{7}$")
     name: str
     description: str
     meals: List[Meal]
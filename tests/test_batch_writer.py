@@ -0,0 +1,104 @@
+"""
+test_batch_writer.py
+
+Tests for how the batch writer resolves the futures of queued meal plan writes.
+Run with: `python -m unittest discover tests`
+"""
+import asyncio
+import threading
+import unittest
+from google.api_core.exceptions import InvalidArgument
+import batch_writer
+from batch_writer import MealPlanBatchWriter
+
+# Fake Firestore client whose batches fail when they hold a rejected document id
+class FakeBatch:
+    def __init__(self, client):
+        self.client = client
+        self.ids = []
+
+    def set(self, document_id, meal_plan_data):
+        self.ids.append(document_id)
+
+    def commit(self):
+        self.client.commits.append(list(self.ids))
+        if self.client.release is not None:
+            self.client.release.wait()
+        for document_id in self.ids:
+            if document_id in self.client.errors:
+                raise self.client.errors[document_id]
+        self.client.saved.extend(self.ids)
+
+class FakeCollection:
+    def document(self, document_id):
+        return document_id
+
+class FakeClient:
+    def __init__(self, errors=None, release=None):
+        self.errors = errors or {}
+        self.release = release
+        self.commits = []
+        self.saved = []
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def collection(self, collection_name):
+        return FakeCollection()
+
+class BatchWriterTest(unittest.IsolatedAsyncioTestCase):
+    async def start_writer(self, client):
+        writer = MealPlanBatchWriter(client, "meal-plans")
+        writer.start()
+        self.addAsyncCleanup(writer.stop)
+        return writer
+
+    async def test_concurrent_writes_share_one_commit(self):
+        client = FakeClient()
+        writer = await self.start_writer(client)
+
+        await asyncio.gather(*(writer.write(f"plan{i:03}", {}) for i in range(5)))
+
+        self.assertEqual(len(client.commits), 1)
+        self.assertCountEqual(client.saved, [f"plan{i:03}" for i in range(5)])
+
+    async def test_rejected_write_fails_alone(self):
+        client = FakeClient(errors={"bad0000": InvalidArgument("document too large")})
+        writer = await self.start_writer(client)
+
+        results = await asyncio.gather(
+            writer.write("good000", {}), writer.write("bad0000", {}), writer.write("good001", {}),
+            return_exceptions=True
+        )
+
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], InvalidArgument)
+        self.assertIsNone(results[2])
+        self.assertCountEqual(client.saved, ["good000", "good001"])
+
+    async def test_cancelled_commit_is_not_saved(self):
+        client = FakeClient(errors={"plan000": asyncio.CancelledError()})
+        writer = await self.start_writer(client)
+
+        with self.assertRaises(asyncio.CancelledError):
+            await writer.write("plan000", {})
+        self.assertEqual(client.saved, [])
+
+    async def test_slow_batch_does_not_block_later_batches(self):
+        release = threading.Event()
+        client = FakeClient(release=release)
+        writer = await self.start_writer(client)
+
+        slow = asyncio.ensure_future(writer.write("slow000", {}))
+        await asyncio.sleep(batch_writer.batch_max_wait * 5)
+        client.release = None
+
+        await asyncio.wait_for(writer.write("fast000", {}), timeout=1)
+        self.assertFalse(slow.done())
+
+        release.set()
+        await slow
+        self.assertCountEqual(client.saved, ["slow000", "fast000"])
+
+if __name__ == "__main__":
+    unittest.main()